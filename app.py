@@ -3,119 +3,299 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 import plotly.express as px
+import pydeck as pdk
 from pathlib import Path
+import os
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+from numba import config, njit, prange
+
+# streamlit runs each session's script in its own thread, and numba's fallback
+# workqueue layer aborts when parallel kernels are called concurrently
+config.THREADING_LAYER = 'threadsafe'
 
 st.set_page_config(page_title="Technician Arrival Dashboard", layout="wide")
 
 st.title("Technician Arrival Dashboard")
 st.write("Track how well technicians arrive on time for their scheduled jobs")
 
+# make sure date columns actually parsed
+def check_datetime_columns(data, columns, file_name):
+    """Raise a ValueError if any of the columns were not parsed as datetimes"""
+    # read_csv leaves unparseable date columns as strings instead of raising
+    for column in columns:
+        if not pd.api.types.is_datetime64_any_dtype(data[column]):
+            raise ValueError(f"{file_name} column '{column}' could not be parsed as ISO 8601 dates")
+
+# read schedule CSV with typed columns
+def read_schedule_csv(path):
+    """Read the schedule CSV, parsing the job times and storing technician ids as categories"""
+    schedules = pd.read_csv(
+        path,
+        parse_dates=['scheduled_start', 'scheduled_end'],
+        date_format='ISO8601'
+    )
+    check_datetime_columns(schedules, ['scheduled_start', 'scheduled_end'], "Schedule.csv")
+    
+    # convert after parsing (like the GPS reader) so numeric ids keep their dtype
+    schedules['technician_id'] = schedules['technician_id'].astype('category')
+    return schedules
+
+# read GPS CSV with typed columns
+def read_gps_csv(path):
+    """Read the GPS CSV, parsing timestamps, storing coordinates as float32 and technician ids as categories"""
+    # read in chunks so large GPS logs don't need the whole file parsed at once
+    chunks = pd.read_csv(
+        path,
+        parse_dates=['timestamp'],
+        date_format='ISO8601',
+        dtype={'latitude': 'float32', 'longitude': 'float32'},
+        chunksize=1_000_000
+    )
+    gps_data = pd.concat(chunks, ignore_index=True)
+    check_datetime_columns(gps_data, ['timestamp'], "GPS.csv")
+    
+    # convert after concat, chunks can each see a different set of technicians
+    gps_data['technician_id'] = gps_data['technician_id'].astype('category')
+    return gps_data
+
+# bump when a CSV reader changes its columns or dtypes, so old parquet copies are ignored
+PARQUET_VERSION = 3
+
+# keep a parquet copy of each CSV so later loads skip CSV parsing
+def read_with_parquet(csv_path, read_csv):
+    """Read the parquet copy of a CSV if it was made from this exact CSV, otherwise read the CSV and try to save one"""
+    parquet_path = csv_path.with_suffix(f'.v{PARQUET_VERSION}.parquet')
+    
+    # the copy records the CSV's mtime and size, and is only used if both still match;
+    # comparing mtimes alone misses a CSV replaced by an older file (cp -p, rsync -t, unzip)
+    csv_stat = csv_path.stat()
+    source = json.dumps({'mtime_ns': csv_stat.st_mtime_ns, 'size': csv_stat.st_size}).encode()
+    
+    if parquet_path.exists():
+        try:
+            table = pq.read_table(parquet_path)
+            if (table.schema.metadata or {}).get(b'source_csv') == source:
+                return table.to_pandas()
+        except (OSError, ValueError):
+            pass  # unreadable copy, rebuild it from the CSV
+    
+    data = read_csv(csv_path)
+    
+    # write to a temp file and swap it in, so a crash never leaves a half written copy;
+    # the copy is only a speedup, so a read only directory just skips it
+    tmp_path = parquet_path.with_name(f'{parquet_path.name}.{os.getpid()}.tmp')
+    try:
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        table = table.replace_schema_metadata({**table.schema.metadata, b'source_csv': source})
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, parquet_path)
+    except (OSError, ValueError):
+        tmp_path.unlink(missing_ok=True)
+    
+    return data
+
+# cache key for a data file, so editing the file invalidates the cache
+def file_cache_key(path):
+    """Hash a path by its name and modification time"""
+    return (str(path), path.stat().st_mtime if path.exists() else None)
+
 # load data from working directory
-def load_data():
+# (cached on the file keys, the same keys the analysis caches use; only the
+# latest version of the files is kept so old copies don't pile up in memory)
+@st.cache_data(max_entries=1)
+def load_data(schedule_key, gps_key, _schedule_path, _gps_path):
     """Load schedule and GPS data from files"""
     schedules = None
     gps_data = None
-        
-    # paths
-    script_dir = Path(__file__).parent
-
-    schedule_path = script_dir / "schedule.csv"
-    gps_path = script_dir / "gps.csv"
     
     # load Schedule.csv 
-    try:
-        schedules = pd.read_csv(schedule_path)
-        st.sidebar.success("Loaded Schedule.csv from directory")
-    except FileNotFoundError:
+    if _schedule_path.exists():
+        try:
+            schedules = read_with_parquet(_schedule_path, read_schedule_csv)
+            st.sidebar.success("Loaded Schedule.csv from directory")
+        except ValueError as e:
+            st.sidebar.error(str(e))
+    else:
         st.sidebar.error("Schedule.csv not found in working directory")
     
     # load GPS.csv  
-    try:
-        gps_data = pd.read_csv(gps_path)
-        st.sidebar.success("Loaded GPS.csv from directory")
-    except FileNotFoundError:
+    if _gps_path.exists():
+        try:
+            gps_data = read_with_parquet(_gps_path, read_gps_csv)
+            st.sidebar.success("Loaded GPS.csv from directory")
+        except ValueError as e:
+            st.sidebar.error(str(e))
+    else:
         st.sidebar.error("GPS.csv not found in working directory")
     
     return schedules, gps_data
 
-# helper function calculates distance between 2 points
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate approximate distance in meters between two GPS points"""
-    # Simple distance calculation (good enough for most use cases)
-    lat_diff = lat1 - lat2
-    lon_diff = lon1 - lon2
-    distance_degrees = (lat_diff**2 + lon_diff**2)**0.5
-    distance_meters = distance_degrees * 111000  # Convert to meters (approximate)
-    return distance_meters
+# arrival distance of 100m, in degrees (1 degree is roughly 111km)
+THR_DEG = 100.0 / 111000.0
+# compare squared degree distances against this to skip the sqrt and unit conversion
+THR_SQ_DEG = THR_DEG ** 2
 
-# find when technician actually arrived
-def find_arrival_time(gps_data, tech_id, job_lat, job_lon, scheduled_time):
-    """Find when a technician actually arrived at a job location"""
+# scan each job's GPS window for the first point within 100m
+@njit(parallel=True, cache=True)
+def scan_arrivals(job_tech, job_lat, job_lon, job_ts, tech_starts, tech_ends, gps_ts, gps_lat, gps_lon, out):
+    """Write the first GPS timestamp within 100m of each job (2 hour window) into out"""
+    window = 2 * 60 * 60 * 1_000_000_000  # 2 hours in nanoseconds
     
-    # get GPS data for this technician around the scheduled time
-    time_window_start = scheduled_time - pd.Timedelta(hours=2)
-    time_window_end = scheduled_time + pd.Timedelta(hours=2)
+    for i in prange(len(job_tech)):
+        tech = job_tech[i]
+        if tech < 0:
+            continue
+        
+        # binary search the window inside this technician's time sorted points,
+        # the end of the window can only be at or after its start
+        start = tech_starts[tech]
+        end = tech_ends[tech]
+        lo = start + np.searchsorted(gps_ts[start:end], job_ts[i] - window, side='left')
+        hi = lo + np.searchsorted(gps_ts[lo:end], job_ts[i] + window, side='right')
+        
+        # points are time sorted, so the first close point is the earliest
+        # arrival and the rest of the window can be skipped
+        for j in range(lo, hi):
+            # cheap bounding box check first, most points are nowhere near the job
+            lat_diff = gps_lat[j] - job_lat[i]
+            if abs(lat_diff) > THR_DEG:
+                continue
+            lon_diff = gps_lon[j] - job_lon[i]
+            if abs(lon_diff) > THR_DEG:
+                continue
+            if lat_diff * lat_diff + lon_diff * lon_diff <= THR_SQ_DEG:
+                out[i] = gps_ts[j]
+                break
+
+# split GPS into column arrays for the arrival kernel
+# (cache_resource shares one copy between reruns instead of unpickling a new one each call;
+# cached on gps_key, the leading underscore stops streamlit hashing the frame itself)
+@st.cache_resource(show_spinner=False, max_entries=1)
+def build_gps_arrays(gps_key, _gps_data):
+    """Sort GPS by technician and time and store each column as its own read only array"""
+    
+    # drop incomplete points first, NaT timestamps and missing ids sort last and
+    # would break the sorted slices the kernel binary searches
+    gps_valid = _gps_data.dropna(subset=['technician_id', 'timestamp', 'latitude', 'longitude'])
     
-    # filter GPS data
-    tech_gps = gps_data[
-        (gps_data['technician_id'] == tech_id) &
-        (gps_data['timestamp'] >= time_window_start) &
-        (gps_data['timestamp'] <= time_window_end)
-    ]
+    # sort GPS once so each technician's points are contiguous and in time order
+    gps_sorted = gps_valid.sort_values(['technician_id', 'timestamp'])
+    techs = pd.Categorical(gps_sorted['technician_id'])
+    tech_codes = np.arange(len(techs.categories))
     
-    if tech_gps.empty:
-        return None
+    gps_arrays = {
+        'techs': techs.categories,
+        'starts': np.searchsorted(techs.codes, tech_codes, side='left'),
+        'ends': np.searchsorted(techs.codes, tech_codes, side='right'),
+        'timestamp': gps_sorted['timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64),
+        # float32 is plenty for a 100m threshold and halves the data scanned
+        'latitude': gps_sorted['latitude'].to_numpy(dtype=np.float32),
+        'longitude': gps_sorted['longitude'].to_numpy(dtype=np.float32)
+    }
     
-    # find GPS points close to the job location
-    tech_gps = tech_gps.copy()
-    tech_gps['distance'] = tech_gps.apply(
-        lambda row: calculate_distance(row['latitude'], row['longitude'], job_lat, job_lon),
-        axis=1
+    # the arrays are shared by every session, so make sure nothing writes to them
+    for key in ['starts', 'ends', 'timestamp', 'latitude', 'longitude']:
+        gps_arrays[key].setflags(write=False)
+    
+    return gps_arrays
+
+# find when technicians actually arrived
+def find_arrival_times(jobs, gps_arrays):
+    """Find when technicians actually arrived at each job location"""
+    
+    # jobs for technicians with no GPS data get -1 and are skipped
+    job_tech = gps_arrays['techs'].get_indexer(jobs['technician_id'])
+    
+    out = np.full(len(jobs), np.iinfo(np.int64).min, dtype=np.int64)  # NaT
+    scan_arrivals(
+        job_tech,
+        jobs['job_latitude'].to_numpy(dtype=np.float64),
+        jobs['job_longitude'].to_numpy(dtype=np.float64),
+        jobs['scheduled_start'].to_numpy(dtype='datetime64[ns]').view(np.int64),
+        gps_arrays['starts'],
+        gps_arrays['ends'],
+        gps_arrays['timestamp'],
+        gps_arrays['latitude'],
+        gps_arrays['longitude'],
+        out
     )
     
-    # find first time they were close to the job
-    close_points = tech_gps[tech_gps['distance'] <= 100]
+    return pd.Series(out.view('datetime64[ns]'), index=jobs.index)
+
+# colors for each status
+STATUS_COLORS = {
+    'Early': 'green',
+    'On Time': 'lightgreen',
+    'Late': 'orange',
+    'Very Late': 'red',
+    'No GPS Data': 'gray'
+}
+
+# RGB colors for each status on the map
+STATUS_RGB = {
+    'Early': [0, 128, 0],
+    'On Time': [144, 238, 144],
+    'Late': [255, 165, 0],
+    'Very Late': [255, 0, 0],
+    'No GPS Data': [128, 128, 128]
+}
+
+# results as CSV bytes for the download button
+# (cached on the same keys as analyze, the results frame itself isn't hashed)
+@st.cache_data(show_spinner=False, max_entries=8)
+def to_csv_bytes(results_key, _df):
+    """Serialize a results frame to CSV bytes"""
+    return _df.to_csv(index=False).encode()
+
+# run the arrival analysis for the selected technicians
+# (cached on the file keys rather than the frames, streamlit only samples large frames when hashing)
+@st.cache_data(show_spinner=False, max_entries=8)
+def analyze(selected_techs, schedules_key, gps_key, _schedules, _gps_data):
+    """Work out arrival times, delays and status for the selected technicians' jobs"""
+    # filter schedules for selected technicians
+    filtered_schedules = _schedules[_schedules['technician_id'].isin(selected_techs)].copy()
+    
+    # find actual arrival times for each job
+    gps_arrays = build_gps_arrays(gps_key, _gps_data)
+    filtered_schedules['actual_arrival'] = find_arrival_times(filtered_schedules, gps_arrays)
     
-    if not close_points.empty:
-        return close_points['timestamp'].min()
+    # Calculate delay in minutes
+    filtered_schedules['delay_minutes'] = (
+        (filtered_schedules['actual_arrival'] - filtered_schedules['scheduled_start'])
+        .dt.total_seconds() / 60
+    )
     
-    return None
+    # categorize how late/early someone was
+    status = pd.cut(
+        filtered_schedules['delay_minutes'],
+        bins=[-np.inf, -5, 5, 30, np.inf],
+        labels=['Early', 'On Time', 'Late', 'Very Late']
+    ).astype(object)
+    status = status.where(filtered_schedules['delay_minutes'].notna(), 'No GPS Data')
+    filtered_schedules['status'] = pd.Categorical(
+        status,
+        categories=['Early', 'On Time', 'Late', 'Very Late', 'No GPS Data'],
+        ordered=True
+    )
+    
+    return filtered_schedules
 
-# categorize how late/early someone was
-def get_arrival_status(delay_minutes):
-    """Categorize arrival status based on delay"""
-    if pd.isna(delay_minutes):
-        return 'No GPS Data'
-    elif delay_minutes <= -5:
-        return 'Early'
-    elif delay_minutes <= 5:
-        return 'On Time'
-    elif delay_minutes <= 30:
-        return 'Late'
-    else:
-        return 'Very Late'
+# paths
+script_dir = Path(__file__).parent
+schedule_path = script_dir / "schedule.csv"
+gps_path = script_dir / "gps.csv"
 
-# function to get colors for status
-def get_status_color(status):
-    """Get color for each status"""
-    colors = {
-        'Early': 'green',
-        'On Time': 'lightgreen', 
-        'Late': 'orange',
-        'Very Late': 'red',
-        'No GPS Data': 'gray'
-    }
-    return colors.get(status, 'gray')
+# take the file keys once so loading and analysis agree on which version of the files they saw
+schedule_key = file_cache_key(schedule_path)
+gps_key = file_cache_key(gps_path)
 
 # load the data 
-schedules, gps_data = load_data()
+schedules, gps_data = load_data(schedule_key, gps_key, schedule_path, gps_path)
 
 if schedules is not None and gps_data is not None:
     try:
-        # convert to datetime
-        schedules['scheduled_start'] = pd.to_datetime(schedules['scheduled_start'])
-        gps_data['timestamp'] = pd.to_datetime(gps_data['timestamp'])
-        
         st.success("Data loaded successfully!")
         
         # show basic overview
@@ -136,45 +316,11 @@ if schedules is not None and gps_data is not None:
         )
         
         if selected_techs:
-            # filter schedules for selected technicians
-            filtered_schedules = schedules[schedules['technician_id'].isin(selected_techs)].copy()
-            
-            # show progress bar
-            progress_bar = st.progress(0)
-            st.write("Analyzing arrivals...")
-            
-            # find actual arrival times for each job
-            actual_arrivals = []
-            total_jobs = len(filtered_schedules)
-            
-            for i, (_, job) in enumerate(filtered_schedules.iterrows()):
-                # Update progress
-                progress_bar.progress((i + 1) / total_jobs)
-                
-                # find arrival when they actually arrived
-                arrival_time = find_arrival_time(
-                    gps_data,
-                    job['technician_id'],
-                    job['job_latitude'],
-                    job['job_longitude'],
-                    job['scheduled_start']
-                )
-                actual_arrivals.append(arrival_time)
-            
-            # add results to dataframe
-            filtered_schedules['actual_arrival'] = actual_arrivals
+            # cached, so reruns with the same selection skip the analysis
+            with st.spinner("Analyzing arrivals..."):
+                results_key = (tuple(selected_techs), schedule_key, gps_key)
+                filtered_schedules = analyze(*results_key, schedules, gps_data)
             
-            # Calculate delay in minutes
-            filtered_schedules['delay_minutes'] = (
-                (filtered_schedules['actual_arrival'] - filtered_schedules['scheduled_start'])
-                .dt.total_seconds() / 60
-            )
-            
-            # add status categories
-            filtered_schedules['status'] = filtered_schedules['delay_minutes'].apply(get_arrival_status)
-            
-            # clear progress bar
-            progress_bar.empty()
             st.success("Analysis complete!")
             
             # result tabs
@@ -184,6 +330,7 @@ if schedules is not None and gps_data is not None:
                 st.subheader("Arrival Performance Summary")
                 
                 status_counts = filtered_schedules['status'].value_counts()
+                status_counts = status_counts[status_counts > 0]
                 
                 # metrics
                 cols = st.columns(len(status_counts))
@@ -197,7 +344,7 @@ if schedules is not None and gps_data is not None:
                     x=status_counts.index,
                     y=status_counts.values,
                     color=status_counts.index,
-                    color_discrete_map={status: get_status_color(status) for status in status_counts.index},
+                    color_discrete_map=STATUS_COLORS,
                     title="Arrival Status Distribution"
                 )
                 fig_bar.update_layout(
@@ -222,19 +369,40 @@ if schedules is not None and gps_data is not None:
             with tab2:
                 st.subheader("Job Locations on Map")
                 
-                # map showing job locations with status
-                fig_map = px.scatter_mapbox(
-                    filtered_schedules,
-                    lat="job_latitude",
-                    lon="job_longitude",
-                    color="status",
-                    color_discrete_map={status: get_status_color(status) for status in filtered_schedules['status'].unique()},
-                    hover_data=['technician_id', 'job_id', 'delay_minutes'],
-                    zoom=10,
+                # map showing job locations with status, drawn on the GPU by deck.gl
+                map_data = filtered_schedules[
+                    ['technician_id', 'job_id', 'job_latitude', 'job_longitude', 'delay_minutes', 'status']
+                ].copy()
+                map_data['color_rgb'] = map_data['status'].astype(object).map(STATUS_RGB)
+                # NaN is not valid JSON for the browser, so show a dash instead
+                map_data['delay_minutes'] = (
+                    map_data['delay_minutes'].round(1).astype(object)
+                    .where(map_data['delay_minutes'].notna(), '-')
+                )
+                
+                layer = pdk.Layer(
+                    "ScatterplotLayer",
+                    data=map_data,
+                    get_position=["job_longitude", "job_latitude"],
+                    get_fill_color="color_rgb",
+                    get_radius=100,
+                    radius_min_pixels=5,
+                    pickable=True
+                )
+                view_state = pdk.ViewState(
+                    latitude=map_data['job_latitude'].mean(),
+                    longitude=map_data['job_longitude'].mean(),
+                    zoom=10
+                )
+                st.pydeck_chart(
+                    pdk.Deck(
+                        layers=[layer],
+                        initial_view_state=view_state,
+                        map_style="light",
+                        tooltip={"text": "{technician_id} - {job_id}\n{status}\nDelay: {delay_minutes} minutes"}
+                    ),
                     height=600
                 )
-                fig_map.update_layout(mapbox_style="open-street-map")
-                st.plotly_chart(fig_map, use_container_width=True)
             
             with tab3:
                 st.subheader("Detailed Results")
@@ -251,10 +419,9 @@ if schedules is not None and gps_data is not None:
                 )
                 
                 # download data
-                csv_data = filtered_schedules.to_csv(index=False)
                 st.download_button(
                     "Download Results",
-                    csv_data,
+                    to_csv_bytes(results_key, filtered_schedules),
                     f"arrival_analysis_{datetime.now().strftime('%Y%m%d')}.csv",
                     "text/csv"
                 )